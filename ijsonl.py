@@ -1,220 +1,738 @@
+import array
+import bisect
+import collections
+import concurrent.futures
+import itertools
 import json
+import logging
+import math
+import mmap
 import os
 import struct
-from json import JSONDecoder
-from typing import List, Tuple, Dict
+import warnings
+from typing import List, Tuple, Dict, Iterable, Optional, OrderedDict
 
 from parse_json_str import parse_json_positions_binary
 import io
 
-class IJSONL:
-    HEADER_FORMAT = '<QQ'  # Two uint64: n and num_fields
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+log = logging.getLogger(__name__)
+
+# Both serializers write the same format: compact separators and raw UTF-8
+_JSON_SEPARATORS = (',', ':')
+if orjson is not None:
+    # Types json.dumps cannot serialize raise TypeError instead of being written
+    _ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME
+                       | orjson.OPT_PASSTHROUGH_DATACLASS
+                       | orjson.OPT_PASSTHROUGH_SUBCLASS)
+
+
+def _has_non_finite(value) -> bool:
+    """Return True if value holds a NaN or infinite float at any depth."""
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(_has_non_finite(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_non_finite(v) for v in value)
+    return False
+
+
+def _dumps(record) -> bytes:
+    """Serialize a record to compact UTF-8 JSON, accepting what json.dumps accepts.
+
+    orjson is used when it is installed. It raises TypeError for non-str keys,
+    integers wider than 64 bits, lone surrogates and non-builtin types, and it
+    writes NaN and infinities as null; those records are written by json.dumps
+    with the same separators instead. Float formatting can still differ between
+    the two (orjson writes 1e16 where json.dumps writes 1e+16); both read back
+    to the same value.
+    """
+    if orjson is not None:
+        try:
+            json_bytes = orjson.dumps(record, option=_ORJSON_OPTIONS)
+        except TypeError:
+            pass
+        else:
+            # Only a record containing null can hold a non-finite float
+            if b'null' not in json_bytes or not _has_non_finite(record):
+                return json_bytes
+    json_str = json.dumps(record, separators=_JSON_SEPARATORS, ensure_ascii=False)
+    try:
+        return json_str.encode('utf-8')
+    except UnicodeEncodeError:
+        # Lone surrogates have no UTF-8 form; write them as \u escapes
+        return json.dumps(record, separators=_JSON_SEPARATORS).encode('utf-8')
+
+# Header fields are stored as a u16 byte length followed by the UTF-8 name
+_FIELD_LENGTH = struct.Struct('<H')
+
+# Index files: a (last_idx, num_entries) header followed by fixed-size entries.
+# Records are stored back to back, so whole-record entries only hold the
+# record's end offset (its start is the previous record's end). Every other
+# field stores its (start, end) relative to the start of its record, which fit
+# in 32 bits.
+_INDEX_HEADER = struct.Struct('qQ')
+_RECORD_ENTRY = struct.Struct('Q')
+_FIELD_ENTRY = struct.Struct('II')
+MAX_RECORD_BYTES = 0xFFFFFFFF
+
+
+def _entry_struct(field: str) -> struct.Struct:
+    """Return the entry layout used by a field's index file."""
+    return _RECORD_ENTRY if field == '__RECORD__' else _FIELD_ENTRY
+
+
+def _is_unversioned_header(buf: bytes) -> bool:
+    """Return True if buf parses exactly as a header from before the format was versioned.
+
+    Those headers start directly with n and num_fields as two u64, followed by
+    the field names.
+    """
+    if len(buf) < 16:
+        return False
+    _, num_fields = struct.unpack_from('<QQ', buf, 0)
+    offset = 16
+    for _ in range(num_fields):
+        if offset + _FIELD_LENGTH.size > len(buf):
+            return False
+        length, = _FIELD_LENGTH.unpack_from(buf, offset)
+        offset += _FIELD_LENGTH.size + length
+    return offset == len(buf)
+
+
+def _preallocate(fd: int, size: int):
+    """Make a file at least `size` bytes long, reserving disk blocks where supported."""
+    if hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, 0, size)
+    elif os.fstat(fd).st_size < size:
+        os.ftruncate(fd, size)
+
+
+def _fsync_path(path: str):
+    """fsync a file or (on POSIX) a directory by path."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 
-    def __init__(self, filename: str):
+class IJSONL:
+    MAGIC = b'IJSONL'
+    FORMAT_VERSION = 2  # Bump whenever the header or index file layout changes
+    HEADER_FORMAT = '<6sHQQ'  # Magic, format version, then two uint64: n and num_fields
+    HEADER_STRUCT = struct.Struct(HEADER_FORMAT)
+    INDEX_CAPACITY = 4096  # Entries preallocated for each new index file
+    AVG_RECORD_BYTES = 256  # Size estimate used when reserving the data file
+    ENTRY_CACHE_SIZE = 4096  # Resolved (field, row) index entries kept in memory
+    PARALLEL_MIN_RECORDS = 32768  # Smallest batch worth scanning in worker processes
+    PARALLEL_CHUNK_SIZE = 1024  # Records sent to a worker process at a time
+
+    def __init__(self, filename: str, expected_records: int = 0):
         self.filename = filename if filename.endswith('.ijsonl') else filename + '.ijsonl'
         os.makedirs(self.filename, exist_ok=True)
         self.header_file = os.path.join(self.filename, f"header.bin")
         self.data_file = os.path.join(self.filename, f"data.jsonl")
         self.index_dir = os.path.join(self.filename, f"indices")
-        
+        self._index_fps: Dict[str, io.BufferedRandom] = {}
+        self._index_headers: Dict[str, Tuple[int, int]] = {}
+        self._index_mmaps: Dict[str, mmap.mmap] = {}
+        self._index_dirty = set()  # Fields whose index header changed since the last commit
+        self._gaps_cache: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._gaps_pending: Dict[str, List[Tuple[int, int]]] = {}  # Written on commit
+        self._gaps_written = set()
+        self._index_paths: Dict[Tuple[str, str], str] = {}
+        self._entry_cache: OrderedDict[Tuple[str, int], Tuple[int, int]] = collections.OrderedDict()
+
         if not os.path.exists(self.header_file):
             self.init_header()
+        # The header is kept in memory and written back on commit
+        self._n, self._fields = self._load_header()
+        self._header_fd = os.open(self.header_file, os.O_RDWR)
+        self._header_dirty = False
         if not os.path.exists(self.index_dir):
             os.makedirs(self.index_dir)
 
+        # Fields with an index on disk; an index created after the last header
+        # write (e.g. before a crash) is recovered into the header here.
+        # Gaps files are tracked in memory too, so appends never stat them.
+        self._field_set = set(self._fields)
+        names = os.listdir(self.index_dir)
+        on_disk = [name[:-len('.index')] for name in names if name.endswith('.index')]
+        self._gaps_files = {name[:-len('.gaps')] for name in names if name.endswith('.gaps')}
+        missing = [field for field in on_disk if field not in self._field_set]
+        if missing:
+            self.update_header(self._n, missing)
+        # n trails the record index if the header write was lost
+        if '__RECORD__' in self._field_set:
+            _, num_records = self._index_header('__RECORD__')
+            if num_records > self._n:
+                self._n = num_records
+                self._header_dirty = True
+        # A commit that did not finish may have written field index headers
+        # past n, or gap runs past a field's committed last_idx; drop them so
+        # the next append does not count them twice
+        for field in self._fields:
+            if field != '__RECORD__' and self._index_header(field)[0] >= self._n:
+                self._clamp_index(field)
+        for field in list(self._gaps_files):
+            if field in self._field_set:
+                self._trim_gaps(field)
+
+        # Long-lived write handle; the write position is tracked in Python.
+        # The file may be preallocated past its logical end, so writes are
+        # positioned after the last indexed record rather than appended.
+        if not os.path.exists(self.data_file):
+            open(self.data_file, 'wb').close()
+        self._data_mmap = None  # Mapped lazily; the file may still be empty
+        self._data_fp = open(self.data_file, 'r+b', buffering=1 << 20)
+        self._data_dirty = False  # Records written to the buffer since the last flush
+        # Worker pool for parallel position scans; started on first use and
+        # kept until close, so batches do not pay the process start-up each time
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._executor_workers = 0
+        self._data_pos = self._data_end()
+        self._data_fp.seek(self._data_pos)
+
+        self._index_capacity = self.INDEX_CAPACITY
+        if expected_records:
+            self.reserve(expected_records)
+
+    def _data_end(self) -> int:
+        """Return the logical end of the data file: the end of the last record."""
+        if '__RECORD__' not in self._field_set:
+            return 0
+        _, num_entries = self._index_header('__RECORD__')
+        if num_entries == 0:
+            return 0
+        return self.get_index_entry('__RECORD__', num_entries - 1)[1]
+
+    def reserve(self, expected_records: int, avg_record_bytes: int = AVG_RECORD_BYTES):
+        """Preallocate the data file and all index files for `expected_records` more records.
+
+        The space is zero-filled past the logical end of each file. A clean
+        close() trims it; after a crash the zeros stay at the end of
+        data.jsonl until later appends overwrite them, so read the data file
+        through the store rather than as plain JSON lines.
+        """
+        self._index_capacity = max(self._index_capacity, expected_records)
+        for name in os.listdir(self.index_dir):
+            if name.endswith('.index'):
+                field = name[:-len('.index')]
+                _, num_entries = self._index_header(field)
+                entry_size = _entry_struct(field).size
+                _preallocate(self._index_fp(field).fileno(), 16 + (num_entries + expected_records) * entry_size)
+        self._flush_data()
+        _preallocate(self._data_fp.fileno(), self._data_pos + expected_records * avg_record_bytes)
+
     def init_header(self):
         """Initialize the binary header file with default values."""
         with open(self.header_file, 'wb') as f:
-            f.write(struct.pack(self.HEADER_FORMAT, 0, 0))  # n = 0, num_fields = 0
+            f.write(self.HEADER_STRUCT.pack(self.MAGIC, self.FORMAT_VERSION, 0, 0))  # n = 0, num_fields = 0
 
-    def update_header(self, n: int, new_fields: List[str]):
-        """Update the binary header file with new values."""
-        current_fields = self.get_fields()
-        all_fields = sorted(set(current_fields + new_fields))
-        
-        with open(self.header_file, 'wb') as f:
-            # Write n and num_fields
-            f.write(struct.pack(self.HEADER_FORMAT, n, len(all_fields)))
-            
-            # Write all fields with their lengths
-            for field in all_fields:
+    def _load_header(self) -> Tuple[int, List[str]]:
+        """Read n and the full field list (including '__RECORD__') from the header file."""
+        with open(self.header_file, 'rb') as f:
+            buf = f.read()
+        if not buf.startswith(self.MAGIC):
+            if _is_unversioned_header(buf):
+                raise ValueError(f"{self.filename} uses the unversioned ijsonl format, which this version cannot "
+                                 f"read; migrate it by adding the records in {self.data_file} to a new store")
+            raise ValueError(f"{self.header_file} is not an ijsonl header (bad magic {buf[:len(self.MAGIC)]!r})")
+        _, version, n, num_fields = self.HEADER_STRUCT.unpack_from(buf, 0)
+        if version != self.FORMAT_VERSION:
+            raise ValueError(f"{self.filename} uses ijsonl format version {version}; "
+                             f"this version reads version {self.FORMAT_VERSION}")
+        offset = self.HEADER_STRUCT.size
+        fields = []
+        for _ in range(num_fields):
+            length, = _FIELD_LENGTH.unpack_from(buf, offset)
+            offset += _FIELD_LENGTH.size
+            fields.append(buf[offset:offset + length].decode('utf-8'))
+            offset += length
+        self._header_size = offset
+        self._fields_written = len(fields)
+        return n, fields
+
+    def _write_header(self):
+        """Write the in-memory n and any new fields to the header file.
+
+        Fields are stored in the order they were added, so new fields are a
+        pure append; the fixed-size prefix is rewritten after the tail.
+        """
+        # Append fields added since the last write
+        if self._fields_written < len(self._fields):
+            tail = bytearray()
+            for field in self._fields[self._fields_written:]:
                 field_bytes = field.encode('utf-8')
-                f.write(struct.pack('<H', len(field_bytes)))  # Write length as unsigned short
-                f.write(field_bytes)
+                tail += _FIELD_LENGTH.pack(len(field_bytes))
+                tail += field_bytes
+            os.pwrite(self._header_fd, tail, self._header_size)
+            self._header_size += len(tail)
+            self._fields_written = len(self._fields)
 
-    def increment_n(self):
-        """Increment the 'n' value in the header."""
-        with open(self.header_file, 'r+b') as f:
-            n, _ = struct.unpack(self.HEADER_FORMAT, f.read(struct.calcsize(self.HEADER_FORMAT)))
-            f.seek(0)
-            f.write(struct.pack('<Q', n + 1))
-        return n + 1
+        # Write n and num_fields
+        os.pwrite(self._header_fd, self.HEADER_STRUCT.pack(self.MAGIC, self.FORMAT_VERSION, self._n, len(self._fields)), 0)
+        self._header_dirty = False
+
+    def update_header(self, n: int, new_fields: List[str]):
+        """Update n and add new fields; the header file is written on commit."""
+        self._n = n
+        for field in new_fields:
+            if field not in self._field_set:
+                self._fields.append(field)
+                self._field_set.add(field)
+        self._header_dirty = True
+
+    def increment_n(self, count: int = 1):
+        """Increment the 'n' value in the header by `count`."""
+        self._n += count
+        self._header_dirty = True
+        return self._n
 
     def get_header_info(self) -> Tuple[int, int]:
-        """Read n and num_fields from the header."""
-        with open(self.header_file, 'rb') as f:
-            return struct.unpack(self.HEADER_FORMAT, f.read(struct.calcsize(self.HEADER_FORMAT)))
+        """Return n and num_fields from the header."""
+        return self._n, len(self._fields)
 
     def get_fields(self) -> List[str]:
-        """Read and return the current fields from the header."""
-        n, num_fields = self.get_header_info()
-        fields = []
-        with open(self.header_file, 'rb') as f:
-            f.seek(struct.calcsize(self.HEADER_FORMAT))
-            for _ in range(num_fields):
-                length = struct.unpack('<H', f.read(2))[0]
-                field = f.read(length).decode('utf-8')
-                if field != '__RECORD__':
-                    fields.append(field)
-        return fields
-
-    def init_index(self, field: str):
-        """Initialize an index file and a gaps file for a new field."""
-        index_file = os.path.join(self.index_dir, f"{field}.index")
-        gaps_file = os.path.join(self.index_dir, f"{field}.gaps")
-        
-        with open(index_file, 'wb') as f:
-            # Truncate the file if it already exists
-            f.truncate(0)
-            # Write initial values for last_idx and num_entries
-            f.write(struct.pack('qQ', -1, 0))
-        
-        # Verify the written values
-        with open(index_file, 'rb') as f:
-            verify_last_idx, verify_num_entries = struct.unpack('qQ', f.read(16))
-        
-        # Create an empty gaps file
-        open(gaps_file, 'wb').close()
+        """Return the current fields from the header."""
+        return sorted(field for field in self._fields if field != '__RECORD__')
 
+    def init_index(self, field: str, capacity: int = None):
+        """Initialize an index file for a new field.
 
-    def append_index(self, field: str, idx: int, start_offset: int, end_offset: int):
-        index_file = os.path.join(self.index_dir, f"{field}.index")
-        print(f"appending index {idx} for field {field}")
-        with open(index_file, 'r+b') as f:
-            # Read current header
-            f.seek(0)
-            header = f.read(16)
+        The index file is preallocated for `capacity` entries (defaults to the
+        current reserve); its header tracks the logical number of entries. The
+        field's gaps file is only created once the field actually skips a row.
+        """
+        index_file = self._index_path(field, '.index')
+        if capacity is None:
+            capacity = self._index_capacity
+        
+        # Drop any handles on a previous index for this field
+        if field in self._index_fps:
+            self._index_fps.pop(field).close()
+        if field in self._index_mmaps:
+            self._index_mmaps.pop(field).close()
+
+        # Create (or truncate) the file and keep it open for the appends to come
+        fp = open(index_file, 'w+b', buffering=64 * 1024)
+        # Write initial values for last_idx and num_entries
+        os.pwrite(fp.fileno(), _INDEX_HEADER.pack(-1, 0), 0)
+        _preallocate(fp.fileno(), 16 + capacity * _entry_struct(field).size)
+        self._index_fps[field] = fp
+        self._index_headers[field] = (-1, 0)
+        self._index_dirty.discard(field)
+
+        # Drop any gaps left over from a previous index for this field
+        if field in self._gaps_files:
+            os.remove(self._index_path(field, '.gaps'))
+            self._gaps_files.discard(field)
+            self._gaps_written.discard(field)
+        self._gaps_pending.pop(field, None)
+        self._gaps_cache.pop(field, None)
+
+
+    def _index_path(self, field: str, suffix: str) -> str:
+        """Return the path of a field's '.index' or '.gaps' file."""
+        key = (field, suffix)
+        path = self._index_paths.get(key)
+        if path is None:
+            path = self._index_paths[key] = os.path.join(self.index_dir, field + suffix)
+        return path
+
+    def _index_fp(self, field: str) -> io.BufferedRandom:
+        """Return the cached read/write handle for a field's index file."""
+        fp = self._index_fps.get(field)
+        if fp is None:
+            fp = open(self._index_path(field, '.index'), 'r+b', buffering=64 * 1024)
+            self._index_fps[field] = fp
+
+            # Read the header once; afterwards it is tracked in memory
+            header = os.pread(fp.fileno(), 16, 0)
             if len(header) == 16:
-                last_idx, num_entries = struct.unpack('QQ', header)
+                self._index_headers[field] = _INDEX_HEADER.unpack(header)
             else:
-                print(f"Warning: Index file for {field} has incomplete header")
-                last_idx, num_entries = -1, 0
-
-            print(f"Appending to index for {field}: idx={idx}, last_idx={last_idx}, num_entries={num_entries}")
-
-            # Update header
-            f.seek(0)
-            f.write(struct.pack('qQ', idx, num_entries + 1))
+                log.warning("Index file for %s has incomplete header", field)
+                self._index_headers[field] = (-1, 0)
+        return fp
+
+    def _index_header(self, field: str) -> Tuple[int, int]:
+        """Return a field's (last_idx, num_entries) index header, cached in memory."""
+        header = self._index_headers.get(field)
+        if header is None:
+            self._index_fp(field)
+            header = self._index_headers[field]
+        return header
 
-            # Append new entry
-            f.seek(0, 2)  # Go to end of file
-            f.write(struct.pack('QQ', start_offset, end_offset))
-
-            print(f"Updated index for {field}: new last_idx={idx}, new num_entries={num_entries + 1}")
+    def append_index(self, field: str, idx: int, start_offset: int, end_offset: int):
+        """Append one entry; offsets are relative to the record start except for '__RECORD__'.
 
+        '__RECORD__' entries only store end_offset, since records are contiguous.
+        """
+        log.debug("Appending index %d for field %s", idx, field)
+        self._append_index_entries(field, [(idx, start_offset, end_offset)])
+
+    def _append_index_entries(self, field: str, entries: List[Tuple[int, int, int]]):
+        """Append (idx, start_offset, end_offset) entries, in row order, to a field's index."""
+        last_idx, num_entries = self._index_header(field)
+
+        # Record runs of rows that skip this field
+        gaps = []
+        for idx, _, _ in entries:
+            if idx > last_idx + 1:
+                gaps.append((last_idx + 1, idx - last_idx - 1))
+            last_idx = idx
+        if gaps:
+            self._append_gaps(field, gaps)
+
+        # Write the new entries in place; the header is written on commit
+        entry = _entry_struct(field)
+        if entry is _RECORD_ENTRY:
+            blob = array.array('Q', [end for _, _, end in entries]).tobytes()
+        else:
+            blob = array.array('I', [offset for _, start, end in entries for offset in (start, end)]).tobytes()
+        offset = 16 + num_entries * entry.size
+        mm = self._index_map(field, offset + len(blob))
+        mm[offset:offset + len(blob)] = blob
+        self._index_headers[field] = (entries[-1][0], num_entries + len(entries))
+        self._index_dirty.add(field)
+
+    def _append_gaps(self, field: str, gaps: List[Tuple[int, int]]):
+        """Queue (start_row, length) runs for a field's gaps file; they are written on commit."""
+        self._gaps_pending.setdefault(field, []).extend(gaps)
+
+        # Keep the cached lookup arrays in step with the file and pending runs
+        cached = self._gaps_cache.get(field)
+        if cached is not None:
+            starts, cumulative = cached
+            for start, length in gaps:
+                starts.append(start)
+                cumulative.append((cumulative[-1] if cumulative else 0) + length)
+
+    def _write_gaps(self):
+        """Append pending gap runs to their fields' gaps files."""
+        for field, gaps in self._gaps_pending.items():
+            with open(self._index_path(field, '.gaps'), 'ab') as f:
+                f.write(array.array('Q', itertools.chain.from_iterable(gaps)).tobytes())
+            self._gaps_files.add(field)
+            self._gaps_written.add(field)
+        self._gaps_pending.clear()
+
+    def _trim_gaps(self, field: str):
+        """Drop gap runs that start after the field's committed last_idx."""
+        last_idx, _ = self._index_header(field)
+        starts, cumulative = self._gaps_index(field)
+        keep = bisect.bisect_right(starts, last_idx)
+        if keep < len(starts):
+            log.warning("Dropping %d uncommitted gap runs for field %s", len(starts) - keep, field)
+            del starts[keep:]
+            del cumulative[keep:]
+            os.truncate(self._index_path(field, '.gaps'), keep * 16)  # Two u64 per run
+
+    def _clamp_index(self, field: str):
+        """Drop a field's index entries for rows at or past n."""
+        _, num_entries = self._index_header(field)
+        starts, cumulative = self._gaps_index(field)
+        # Rows below n that skip this field, and the last row below n that has it
+        last_idx = self._n - 1
+        skipped = 0
+        for i in range(bisect.bisect_right(starts, last_idx)):
+            length = cumulative[i] - (cumulative[i - 1] if i else 0)
+            gap_end = min(starts[i] + length, self._n)
+            skipped += gap_end - starts[i]
+            if gap_end == self._n:
+                last_idx = starts[i] - 1
+        clamped = (last_idx, self._n - skipped)
+        log.warning("Dropping %d uncommitted index entries for field %s",
+                    num_entries - clamped[1], field)
+        self._index_headers[field] = clamped
+        self._index_dirty.add(field)
+
+    def commit(self):
+        """Flush buffered record data, then write the gaps, index headers and header that changed.
+
+        The writes always go in the same order: gaps, then field index
+        headers, then '__RECORD__', then the header. A crash part way through
+        can only leave gap runs past a field's last_idx or field entries past
+        n; both are dropped on open.
+        """
+        self._flush_data()
+        self._write_gaps()
+        for field in sorted(self._index_dirty - {'__RECORD__'}):
+            self._write_index_header(field)
+        if '__RECORD__' in self._index_dirty:
+            self._write_index_header('__RECORD__')
+        self._index_dirty.clear()
+        if self._header_dirty:
+            self._write_header()
+
+    def _write_index_header(self, field: str):
+        """Write a field's in-memory (last_idx, num_entries) to its index file."""
+        _INDEX_HEADER.pack_into(self._index_map(field), 0, *self._index_headers[field])
+
+    def close(self):
+        """Commit pending writes, sync them to disk and close all cached file handles.
+
+        Preallocated space past the logical end of the data and index files is
+        trimmed here.
+        """
+        if self._data_fp.closed:
+            return
+        self.commit()
+        self._shutdown_executor()
+
+        if self._data_mmap is not None:
+            self._data_mmap.close()
+            self._data_mmap = None
+        for mm in self._index_mmaps.values():
+            mm.flush()
+            mm.close()
+        self._index_mmaps.clear()
+        self._gaps_cache.clear()
+        self.clear_cache()
+
+        self._data_fp.truncate(self._data_pos)
+        os.fsync(self._data_fp.fileno())
+        self._data_fp.close()
+        for field, fp in self._index_fps.items():
+            _, num_entries = self._index_headers[field]
+            fp.truncate(16 + num_entries * _entry_struct(field).size)
+            os.fsync(fp.fileno())
+            fp.close()
+        self._index_fps.clear()
+        self._index_headers.clear()
+        for field in self._gaps_written:
+            _fsync_path(self._index_path(field, '.gaps'))
+        self._gaps_written.clear()
+        os.fsync(self._header_fd)
+        os.close(self._header_fd)
+
+        # Make newly created files durable too
+        if os.name == 'posix':
+            _fsync_path(self.index_dir)
+            _fsync_path(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        """Release the maps and file handles of a store that was never closed.
+
+        Nothing is committed, trimmed or synced here: use close() or a with
+        block for a durable shutdown. Uncommitted appends are recovered or
+        dropped on the next open, like after a crash.
+        """
+        if not hasattr(self, '_data_fp') or self._data_fp.closed:
+            return
+        warnings.warn(f"IJSONL store {self.filename} was not closed", ResourceWarning, source=self)
+        self._shutdown_executor(wait=False)
+        if self._data_mmap is not None:
+            self._data_mmap.close()
+        for mm in self._index_mmaps.values():
+            mm.close()
+        for fp in self._index_fps.values():
+            fp.close()
+        self._data_fp.close()
+        os.close(self._header_fd)
+
+
+    def _index_map(self, field: str, min_size: int = 16) -> mmap.mmap:
+        """Return a shared, writable map of a field's index file of at least `min_size` bytes.
+
+        Appends write through this map; when one would run past the end of the
+        file, the file is grown to at least double its size and mapped again.
+        """
+        mm = self._index_mmaps.get(field)
+        if mm is None or len(mm) < min_size:
+            fd = self._index_fp(field).fileno()
+            size = os.fstat(fd).st_size
+            if size < min_size:
+                _preallocate(fd, max(min_size, 2 * size))
+            if mm is not None:
+                mm.close()
+            mm = mmap.mmap(fd, 0)
+            self._index_mmaps[field] = mm
+        return mm
 
     def get_index_entry(self, field: str, row_number: int) -> Tuple[int, int]:
-        """Read an index entry for a field, given the row number."""
-        index_file = os.path.join(self.index_dir, f"{field}.index")
-
-        with open(index_file, 'rb') as f:
-            last_idx, num_entries = struct.unpack('qQ', f.read(16))
-
-            if row_number > last_idx:
-                raise IndexError(f"Row number {row_number} out of range for field: {field} (last_idx: {last_idx})")
-            
-            # Correctly map row_number to index position
-            index_position = self.row_idx_to_index_idx(field, row_number)
-            if index_position == -1:
-                return None, None
-
-            if index_position > num_entries - 1:
-                return None, None
-                raise IndexError(f"Row number {row_number} maps to index position {index_position} exceeding field entries: {num_entries} for field: {field}")
+        """Read an index entry for a field, given the row number.
 
-            f.seek(16 + index_position * 16)  # 16 bytes for header, 16 bytes per entry
-            return struct.unpack('QQ', f.read(16))
+        Returns (None, None) for rows that do not have the field, and raises
+        IndexError for rows that have not been added yet. Rows are append-only,
+        so resolved entries never change and are kept in a small LRU cache.
+        """
+        key = (field, row_number)
+        cached = self._entry_cache.get(key)
+        if cached is None:
+            cached = self._read_index_entry(field, row_number)
+            if len(self._entry_cache) >= self.ENTRY_CACHE_SIZE:
+                self._entry_cache.popitem(last=False)
+            self._entry_cache[key] = cached
+        else:
+            self._entry_cache.move_to_end(key)
+        return cached
+
+    def clear_cache(self):
+        """Drop all cached index entries."""
+        self._entry_cache.clear()
+
+    def _read_index_entry(self, field: str, row_number: int) -> Tuple[int, int]:
+        # Map row_number to index position using the in-memory header and gaps
+        index_position = self.row_idx_to_index_idx(field, row_number)
+        if index_position == -1:
+            if row_number >= self._n:
+                raise IndexError(f"Row number {row_number} out of range for field: {field} (n: {self._n})")
+            return None, None
+
+        entry = _entry_struct(field)
+        offset = 16 + index_position * entry.size  # 16 bytes for header, then fixed-size entries
+        mm = self._index_map(field, offset + entry.size)
+        if entry is _RECORD_ENTRY:
+            end, = entry.unpack_from(mm, offset)
+            start = entry.unpack_from(mm, offset - entry.size)[0] if index_position else 0
+            return start, end
+
+        # Field offsets are relative to the start of their record
+        start, end = entry.unpack_from(mm, offset)
+        record_start, _ = self.get_index_entry('__RECORD__', row_number)
+        return record_start + start, record_start + end
+
+    def _gaps_index(self, field: str) -> Tuple[List[int], List[int]]:
+        """Return a field's sorted gap starts and the running total of gap lengths.
+
+        The .gaps file is a run-length list of (start_row, length) pairs, written
+        in row order, so it is already sorted by start.
+        """
+        cached = self._gaps_cache.get(field)
+        if cached is None:
+            gaps = array.array('Q')
+            if field in self._gaps_files:
+                with open(self._index_path(field, '.gaps'), 'rb') as f:
+                    gaps.frombytes(f.read())
+            gaps.extend(itertools.chain.from_iterable(self._gaps_pending.get(field, ())))
+            starts = gaps[0::2].tolist()
+            cumulative = list(itertools.accumulate(gaps[1::2]))
+            cached = self._gaps_cache[field] = (starts, cumulative)
+        return cached
 
     def row_idx_to_index_idx(self, field, row_idx):
-        index_file = os.path.join(self.index_dir, f"{field}.index")
-        gaps_file = os.path.join(self.index_dir, f"{field}.gaps")
-        try:
-            with open(gaps_file, 'rb') as f:
-                gaps = []
-                while True:
-                    gap_data = f.read(16)
-                    if not gap_data:
-                        break
-                    gaps.append(struct.unpack('QQ', gap_data))
-        except FileNotFoundError:
-            gaps = []  # No gaps file, so no gaps to account for
-            gaps.sort(key=lambda x: x[0])
-            # Read index file
-
-        with open(index_file, 'rb') as f:
-            index = []
-            while True:
-                index_data = f.read(16)
-                if not index_data:
-                    break
-                index.append(struct.unpack('QQ', index_data))
-        
-        # Calculate the actual position in the index list
-        actual_pos = row_idx
-        for start, length in gaps:
-            if row_idx >= start:
-                if row_idx < start + length:
-                    return -1  # n is within a gap
-                actual_pos -= length
-            else:
-                break
-        
-        # Check if the actual position is within the index list
-        if 0 <= actual_pos < len(index):
+        starts, cumulative = self._gaps_index(field)
+
+        # Find the last gap starting at or before row_idx
+        i = bisect.bisect_right(starts, row_idx) - 1
+        if i >= 0:
+            gap_length = cumulative[i] - (cumulative[i - 1] if i else 0)
+            if row_idx < starts[i] + gap_length:
+                return -1  # row_idx is within a gap
+            actual_pos = row_idx - cumulative[i]
+        else:
+            actual_pos = row_idx
+
+        # Check if the actual position is within the index entries
+        _, num_entries = self._index_header(field)
+        if 0 <= actual_pos < num_entries:
             return actual_pos
-            # return index[actual_pos]
         else:
             return -1  # Out of range
 
 
     def add_record(self, record: Dict):
         """Add a new record to the data file and update indices."""
-        json_str = json.dumps(record)
-        print(f"Adding record: {json_str}")
-        
-        # Append to data file
-        with open(self.data_file, 'a') as f:
-            start_pos = f.tell()
-            f.write(json_str + '\n')
-            end_pos = f.tell()
-
-        # Increment N
-        n = self.increment_n()
-
-        # Traverse JSON and update indices
-        field_positions = parse_json_positions_binary(
-                json_str.encode('utf-8'))
-        field_positions["__RECORD__"] = field_positions[""]
-        print(f"Field positions: {field_positions}")
-        
+        self.add_records([record])
+
+    def _scan_positions(self, records: List[bytes], workers: Optional[int]) -> Iterable[Dict[str, Tuple[int, int]]]:
+        """Run parse_json_positions_binary over serialized records, in order.
+
+        Large batches are spread over `workers` processes; results come back in
+        input order, so offsets can still be assigned sequentially.
+        """
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 1) - 1)
+        if workers > 1 and len(records) >= self.PARALLEL_MIN_RECORDS:
+            executor = self._scan_executor(workers)
+            return list(executor.map(parse_json_positions_binary, records, chunksize=self.PARALLEL_CHUNK_SIZE))
+        return map(parse_json_positions_binary, records)
+
+    def _scan_executor(self, workers: int) -> concurrent.futures.ProcessPoolExecutor:
+        """Return the store's worker pool, starting it (again) for a new worker count."""
+        if self._executor is None or self._executor_workers != workers:
+            self._shutdown_executor()
+            self._executor = concurrent.futures.ProcessPoolExecutor(workers)
+            self._executor_workers = workers
+        return self._executor
+
+    def _shutdown_executor(self, wait: bool = True):
+        """Stop the worker pool, if one was started."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def add_records(self, records: Iterable[Dict], workers: Optional[int] = 1):
+        """Add many records with a single data write and one index write per field.
+
+        :param workers: Processes used to scan field positions in batches of at
+            least PARALLEL_MIN_RECORDS; None uses all but one CPU. The pool is
+            kept until close(). All writes stay in this process.
+        """
+        n, _ = self.get_header_info()
+        serialized = []
+        for record in records:
+            json_bytes = _dumps(record)
+            log.debug("Adding record: %s", json_bytes)
+            if len(json_bytes) > MAX_RECORD_BYTES:
+                raise ValueError(f"Record of {len(json_bytes)} bytes exceeds the {MAX_RECORD_BYTES} byte limit")
+            serialized.append(json_bytes)
+
+        chunks = []
+        pending: Dict[str, List[Tuple[int, int, int]]] = {}
+        pos = self._data_pos
+        all_positions = self._scan_positions(serialized, workers)
+        for idx, (json_bytes, field_positions) in enumerate(zip(serialized, all_positions), n):
+            chunks.append(json_bytes)
+            chunks.append(b'\n')
+            start_pos, end_pos = pos, pos + len(json_bytes) + 1
+
+            field_positions["__RECORD__"] = field_positions[""]
+            log.debug("Field positions: %s", field_positions)
+            for field, (start, end) in field_positions.items():
+                if field == '__RECORD__':
+                    entry = (idx, start_pos, end_pos)
+                else:
+                    entry = (idx, start, end)
+                pending.setdefault(field, []).append(entry)
+            pos = end_pos
+        if not chunks:
+            return
+
+        # Append to data file; the buffered writer coalesces the pieces into
+        # as few write syscalls as its buffer allows, without joining them first
+        self._data_fp.writelines(chunks)
+        self._data_dirty = True
+        self._data_pos = pos
+
+        n = self.increment_n(len(chunks) // 2)
+
         new_fields = []
-        for field, (start, end) in field_positions.items():
-            index_file = os.path.join(self.index_dir, f"{field}.index")
-            if not os.path.exists(index_file):
+        for field, entries in pending.items():
+            if field not in self._field_set:
                 new_fields.append(field)
                 self.init_index(field)
-            
-            if field == '__RECORD__':
-                self.append_index(field, n - 1, start_pos, end_pos)
-            else:
-                self.append_index(field, n - 1, start_pos + start, start_pos + end)
+            self._append_index_entries(field, entries)
         # Update header if there are new fields
         if new_fields:
             self.update_header(n, new_fields)
 
-        print(f"New fields: {new_fields}")
-        print(f"All fields: {self.get_fields()}")
-
+        log.debug("New fields: %s", new_fields)
 
     def _set_nested_dict(self, d, keys, value):
         """Helper method to set value in nested dictionary."""
@@ -222,6 +740,37 @@ class IJSONL:
             d = d.setdefault(key, {})
         d[keys[-1]] = value
 
+    def _flush_data(self):
+        """Write buffered records to the data file so maps and other readers see them."""
+        if self._data_dirty:
+            self._data_fp.flush()
+            self._data_dirty = False
+
+    def _data_map(self, min_size: int) -> mmap.mmap:
+        """Return a read-only map of the data file of at least `min_size` bytes."""
+        mm = self._data_mmap
+        if mm is None or len(mm) < min_size:
+            # Records were appended past the current mapping; map it again
+            self._flush_data()
+            if mm is not None:
+                mm.close()
+            mm = self._data_mmap = mmap.mmap(self._data_fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return mm
+
+    def _read_ranges(self, ranges: Dict[str, Tuple[int, int]]) -> Dict[str, bytes]:
+        """Slice byte ranges out of the mapped data file."""
+        if not ranges:
+            return {}
+        lo = min(start for start, _ in ranges.values())
+        hi = max(end for _, end in ranges.values())
+        mm = self._data_map(hi)
+        if hasattr(mmap, 'MADV_WILLNEED') and lo // mmap.PAGESIZE != (hi - 1) // mmap.PAGESIZE:
+            # The ranges span several pages; have the kernel read them in together
+            # instead of faulting them in one at a time while slicing
+            page_lo = lo - lo % mmap.PAGESIZE
+            mm.madvise(mmap.MADV_WILLNEED, page_lo, hi - page_lo)
+        return {key: mm[start:end] for key, (start, end) in ranges.items()}
+
     def get_record(self, index: int, fields=None):
         """
         Get record data by index using field indices.
@@ -230,13 +779,12 @@ class IJSONL:
         :param fields: None for full record, a string for a single field, or a list of fields.
         :return: The requested data (str, bytes, or dict depending on fields parameter).
         """
+        self._flush_data()
         if fields is None:
             # Retrieve full record
             start, end = self.get_index_entry('__RECORD__', index)
             if start == None: return None
-            with open(self.data_file, 'rb') as f:
-                f.seek(start)
-                return f.read(end - start)
+            return self._data_map(end)[start:end]
         
         is_str = isinstance(fields, str)
         if is_str:
@@ -244,20 +792,20 @@ class IJSONL:
         if isinstance(fields, list):
             # Retrieve multiple fields
             result = {}
+            ranges = {}
             for field in fields:
-                if not os.path.exists(os.path.join(self.index_dir, f"{field}.index")):
+                if field not in self._field_set:
                     result[field] = None
                 else:
                     try:
                         start, end = self.get_index_entry(field, index)
                         if start == None: return None
-                        with open(self.data_file, 'rb') as f:
-                            f.seek(start)
-                            result[field] = f.read(end - start)
+                        ranges[field] = (start, end)
                     except FileNotFoundError:
                         # Field index doesn't exist, set to None
                         result[field] = None
-            return result
+            result.update(self._read_ranges(ranges))
+            return {field: result[field] for field in fields}
         if is_str:
             result = result[fields[0]]
         
@@ -267,9 +815,6 @@ class IJSONL:
 
 # Example usage and testing
 if __name__ == "__main__":
-    # Initialize IJSONL
-    ijsonl = IJSONL("test_data")
-
     # Test data with nested structures and varying fields
     test_records = [
         {
@@ -318,53 +863,55 @@ if __name__ == "__main__":
         }
     ]
 
-    # Add records
-    for record in test_records:
-        ijsonl.add_record(record)
-
-    while True:
-        print("Testing get_record method:")
-
-        # Test getting full records
-        print("\nFull Records:")
-        for i in range(3):
-            print(f"Record {i}:", ijsonl.get_record(i))
-
-        # Test getting single fields
-        print("\nSingle Fields:")
-        print("Address (Record 0):", ijsonl.get_record(0, "address.city"))
-        print("Address (Record 0):", ijsonl.get_record(0, "address.city"))
-        print("Name (Record 0):", ijsonl.get_record(0, "name"))
-        print("Name (Record 0):", ijsonl.get_record(0, "name"))
-        print("Name (Record 1):", ijsonl.get_record(1, "name"))
-        print("Name (Record 2):", ijsonl.get_record(2, "name"))
-        print("Age (Record 1):", ijsonl.get_record(1, "age"))
-        print("Address (Record 0):", ijsonl.get_record(0, "address"))
-        print("Address (Record 0):", ijsonl.get_record(0, "address.city"))
-        print("Address (Record 0):", ijsonl.get_record(0, "address.dog"))
+    # Initialize IJSONL; closing it flushes everything to disk
+    with IJSONL("test_data") as ijsonl:
+        # Add records
+        for record in test_records:
+            ijsonl.add_record(record)
+
+        while True:
+            print("Testing get_record method:")
+
+            # Test getting full records
+            print("\nFull Records:")
+            for i in range(3):
+                print(f"Record {i}:", ijsonl.get_record(i))
+
+            # Test getting single fields
+            print("\nSingle Fields:")
+            print("Address (Record 0):", ijsonl.get_record(0, "address.city"))
+            print("Address (Record 0):", ijsonl.get_record(0, "address.city"))
+            print("Name (Record 0):", ijsonl.get_record(0, "name"))
+            print("Name (Record 0):", ijsonl.get_record(0, "name"))
+            print("Name (Record 1):", ijsonl.get_record(1, "name"))
+            print("Name (Record 2):", ijsonl.get_record(2, "name"))
+            print("Age (Record 1):", ijsonl.get_record(1, "age"))
+            print("Address (Record 0):", ijsonl.get_record(0, "address"))
+            print("Address (Record 0):", ijsonl.get_record(0, "address.city"))
+            print("Address (Record 0):", ijsonl.get_record(0, "address.dog"))
         
-        # print("Street (Record 0):", ijsonl.get_record(1, "address"))
-        # print("Pets (Record 2):", ijsonl.get_record(2, "pets.0.type"))
-        print("Pets (Record 2):", ijsonl.get_record(0, "pets"))
-
-        # Test getting nested fields
-        print("\nNested Fields:")
-        print("Address.City (Record 0):", ijsonl.get_record(0, "address.city"))
-        print("Job.Company.Name (Record 1):", ijsonl.get_record(0, "job.company.name"))
-        print("Education.University.Location (Record 2):", ijsonl.get_record(2, "education.university.location"))
-
-        # Test getting multiple fields
-        print("\nMultiple Fields:")
-        print("Name and Age (Record 0):", ijsonl.get_record(0, ["name", "age"]))
-        print("Skills and Job.Title (Record 1):", ijsonl.get_record(1, ["skills", "job.title"]))
-        print("Name and Pets[0].Name (Record 2):", ijsonl.get_record(2, ["name", "pets.0.name"]))
-
-        # Test getting non-existent fields
-        print("\nNon-existent Fields:")
-        print("Non-existent field (Record 0):", ijsonl.get_record(0, "non_existent"))
-        print("Multiple fields including non-existent (Record 1):", ijsonl.get_record(1, ["name", "non_existent", "age"]))
-
-        print("\nTesting complete.")
-        break
+            # print("Street (Record 0):", ijsonl.get_record(1, "address"))
+            # print("Pets (Record 2):", ijsonl.get_record(2, "pets.0.type"))
+            print("Pets (Record 2):", ijsonl.get_record(0, "pets"))
+
+            # Test getting nested fields
+            print("\nNested Fields:")
+            print("Address.City (Record 0):", ijsonl.get_record(0, "address.city"))
+            print("Job.Company.Name (Record 1):", ijsonl.get_record(0, "job.company.name"))
+            print("Education.University.Location (Record 2):", ijsonl.get_record(2, "education.university.location"))
+
+            # Test getting multiple fields
+            print("\nMultiple Fields:")
+            print("Name and Age (Record 0):", ijsonl.get_record(0, ["name", "age"]))
+            print("Skills and Job.Title (Record 1):", ijsonl.get_record(1, ["skills", "job.title"]))
+            print("Name and Pets[0].Name (Record 2):", ijsonl.get_record(2, ["name", "pets.0.name"]))
+
+            # Test getting non-existent fields
+            print("\nNon-existent Fields:")
+            print("Non-existent field (Record 0):", ijsonl.get_record(0, "non_existent"))
+            print("Multiple fields including non-existent (Record 1):", ijsonl.get_record(1, ["name", "non_existent", "age"]))
+
+            print("\nTesting complete.")
+            break
     import shutil
     shutil.rmtree("test_data.ijsonl")
\ No newline at end of file
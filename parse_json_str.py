@@ -1,124 +1,168 @@
-import io
+import re
+import sys
+
+_WHITESPACE = frozenset(b' \t\n\r\x0b\x0c')  # The bytes that bytes.isspace() accepts
+_WHITESPACE_RUN = re.compile(rb'[ \t\n\r\x0b\x0c]+')
+# The JSON number grammar, plus the -Infinity that json.dumps writes for
+# non-finite floats (NaN and Infinity are matched as keywords)
+_NUMBER = re.compile(rb'-Infinity|-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?')
+_NUMBER_START = frozenset(b'0123456789-')
+
+# Raw key bytes -> decoded, interned key. JSONL records repeat the same few
+# keys, so most keys skip the decode and share one string object across calls.
+_KEY_CACHE = {}
+_KEY_CACHE_SIZE = 1024
+
+def _skip_whitespace(data, i):
+    """Return the index of the first non-whitespace byte; data[i] is whitespace.
+
+    Separators are usually a single space; longer runs (indentation) are
+    skipped in one regex match.
+    """
+    i += 1
+    if data[i] in _WHITESPACE:
+        i = _WHITESPACE_RUN.match(data, i).end()
+    return i
+
+def _string_end(data, i):
+    """Return the index just past the string whose opening quote is at i."""
+    i += 1  # Skip opening quote
+    while True:
+        # Jump to the next quote; it ends the string unless it is escaped,
+        # i.e. preceded by an odd number of backslashes
+        i = data.find(0x22, i)
+        if i == -1:
+            raise ValueError("Unterminated string")
+        backslashes = 0
+        while data[i - 1 - backslashes] == 0x5c:
+            backslashes += 1
+        i += 1
+        if not backslashes % 2:
+            return i
 
 def parse_json_positions_binary(json_data):
-    positions = {}
-    f = io.BytesIO(json_data)
-
-    def read_char():
-        return f.read(1)
-
-    def peek_char():
-        char = f.read(1)
-        f.seek(-1, 1)  # Move back one byte
-        return char
+    """Return the (start, end) byte range of every value in a JSON object or array.
 
-    def consume_whitespace():
-        while peek_char().isspace():
-            f.seek(1, 1)
+    Values are keyed by dotted path (list items by index); the whole document
+    is stored under "". Malformed or truncated input raises ValueError.
 
-    def parse_string():
-        start = f.tell()
-        f.seek(1, 1)  # Skip opening quote
+    Keys are decoded once and cached in _KEY_CACHE, which keeps the first
+    _KEY_CACHE_SIZE distinct keys seen by the process and is never evicted;
+    later new keys are decoded on every call.
+    """
+    positions = {}
+    # Work on the bytes directly with an integer cursor: indexing yields ints,
+    # so each step is a single C-level lookup rather than io-layer calls.
+    # (bytes() is a no-op for bytes; other buffers are copied so key slices hash.)
+    data = bytes(json_data)
+
+    # A single loop over an explicit stack of open containers. Scalars are
+    # recorded as they are read and containers when they close, so children
+    # come before their parents in positions.
+    try:
+        i = 0
+        if data[i] in _WHITESPACE:
+            i = _skip_whitespace(data, i)
+        char = data[i]
+        if char != 0x7b and char != 0x5b:
+            raise ValueError("JSON must start with '{' or '['")
+
+        # The open container: its closing byte, the prefix for its children,
+        # its own path and start, and the next list index. Enclosing
+        # containers are saved on the stack. Top-level keys have no leading dot.
+        stack = []
+        closer = 0x7d if char == 0x7b else 0x5d
+        base = "" if char == 0x7b else "."
+        path, start, index = "", i, 0
+        i += 1
         while True:
-            char = read_char()
-            if not char:
-                raise ValueError("Unterminated string")
-            if char == b'\\':
-                # This is an escape character, skip the next character
-                next_char = read_char()
-                if not next_char:
-                    raise ValueError("Unterminated escape sequence")
-            elif char == b'"':
-                # We've found an unescaped quote, end of string
-                return start, f.tell()
-
-    def parse_number():
-        start = f.tell()
-        while peek_char() in b'0123456789+-.eE':
-            f.seek(1, 1)
-        return start, f.tell()
-
-    def parse_keyword(keyword):
-        start = f.tell()
-        for expected_byte in keyword.encode():
-            if read_char() != bytes([expected_byte]):
-                raise ValueError(f"Expected {keyword}")
-        return start, f.tell()
-
-    def parse_value(prefix=None):
-        char = peek_char()
-        if char == b'"':
-            return parse_string()
-        elif char in b'0123456789-':
-            return parse_number()
-        elif char == b't':
-            return parse_keyword('true')
-        elif char == b'f':
-            return parse_keyword('false')
-        elif char == b'n':
-            return parse_keyword('null')
-        elif char == b'{':
-            return parse_struct(prefix)
-        elif char == b'[':
-            return parse_list(prefix)
-        else:
-            raise ValueError(f"Unexpected character: {char}")
-
-    def parse_list(prefix):
-        start = f.tell()
-        f.seek(1, 1)  # Skip opening bracket
-        consume_whitespace()
-        index = 0
-        while peek_char() != b']':
-            new_prefix = f"{prefix}.{index}" if prefix is not None else str(index)
-            value_start, value_end = parse_value(new_prefix)
-            positions[new_prefix] = (value_start, value_end)
-            index += 1
-            consume_whitespace()
-            if peek_char() == b',':
-                f.seek(1, 1)  # Skip comma
-                consume_whitespace()
-            elif peek_char() != b']':
-                raise ValueError("Expected ',' or ']'")
-        f.seek(1, 1)  # Skip closing bracket
-        end = f.tell()
-        if prefix is not None:
-            positions[prefix] = (start, end)
-        return start, end
-
-    def parse_struct(prefix):
-        start = f.tell()
-        f.seek(1, 1)  # Skip opening brace
-        consume_whitespace()
-        while peek_char() != b'}':
-            key_start, key_end = parse_string()
-            key = json_data[key_start+1:key_end-1].decode()
-            consume_whitespace()
-            if read_char() != b':':
-                raise ValueError("Expected ':'")
-            consume_whitespace()
-            new_prefix = f"{prefix}.{key}" if prefix else key
-            value_start, value_end = parse_value(new_prefix)
-            positions[new_prefix] = (value_start, value_end)
-            consume_whitespace()
-            if peek_char() == b',':
-                f.seek(1, 1)  # Skip comma
-                consume_whitespace()
-            elif peek_char() != b'}':
-                raise ValueError("Expected ',' or '}'")
-        f.seek(1, 1)  # Skip closing brace
-        end = f.tell()
-        if prefix is not None:
-            positions[prefix] = (start, end)
-        return start, end
-
-    consume_whitespace()
-    if peek_char() == b'{':
-        parse_struct("")
-    elif peek_char() == b'[':
-        parse_list("")
-    else:
-        raise ValueError("JSON must start with '{' or '['")
+            if data[i] in _WHITESPACE:
+                i = _skip_whitespace(data, i)
+            char = data[i]
+            if char == closer:
+                i += 1
+                positions[path] = (start, i)
+                if not stack:
+                    break
+                closer, base, path, start, index = stack.pop()
+            else:
+                if closer == 0x7d:
+                    if char != 0x22:
+                        raise ValueError("Expected '\"'")
+                    key_end = _string_end(data, i)
+                    raw_key = data[i+1:key_end-1]
+                    key = _KEY_CACHE.get(raw_key)
+                    if key is None:
+                        key = sys.intern(raw_key.decode())
+                        if len(_KEY_CACHE) < _KEY_CACHE_SIZE:
+                            _KEY_CACHE[raw_key] = key
+                    i = key_end
+                    if data[i] in _WHITESPACE:
+                        i = _skip_whitespace(data, i)
+                    if data[i] != 0x3a:
+                        raise ValueError("Expected ':'")
+                    i += 1
+                    if data[i] in _WHITESPACE:
+                        i = _skip_whitespace(data, i)
+                    value_path = base + key
+                else:
+                    value_path = base + str(index)
+                    index += 1
+
+                char = data[i]
+                if char == 0x22:
+                    end = _string_end(data, i)
+                elif char in _NUMBER_START:
+                    match = _NUMBER.match(data, i)
+                    if match is None:
+                        raise ValueError("Invalid number")
+                    end = match.end()
+                elif char == 0x7b or char == 0x5b:
+                    # Open a nested container; it is recorded when it closes
+                    stack.append((closer, base, path, start, index))
+                    if char == 0x7b:
+                        closer, base = 0x7d, f"{value_path}." if value_path else ""
+                    else:
+                        closer, base = 0x5d, f"{value_path}."
+                    path, start, index = value_path, i, 0
+                    i += 1
+                    continue
+                elif char == 0x74:  # t
+                    end = i + 4
+                    if data[i:end] != b'true':
+                        raise ValueError("Expected true")
+                elif char == 0x66:  # f
+                    end = i + 5
+                    if data[i:end] != b'false':
+                        raise ValueError("Expected false")
+                elif char == 0x6e:  # n
+                    end = i + 4
+                    if data[i:end] != b'null':
+                        raise ValueError("Expected null")
+                elif char == 0x4e:  # N
+                    end = i + 3
+                    if data[i:end] != b'NaN':
+                        raise ValueError("Expected NaN")
+                elif char == 0x49:  # I
+                    end = i + 8
+                    if data[i:end] != b'Infinity':
+                        raise ValueError("Expected Infinity")
+                else:
+                    raise ValueError(f"Unexpected character: {bytes([char])}")
+                positions[value_path] = (i, end)
+                i = end
+
+            # After a value: a comma, or the end of the enclosing container
+            if data[i] in _WHITESPACE:
+                i = _skip_whitespace(data, i)
+            char = data[i]
+            if char == 0x2c:
+                i += 1  # Skip comma
+            elif char != closer:
+                raise ValueError("Expected ',' or '}'" if closer == 0x7d else "Expected ',' or ']'")
+    except IndexError:
+        # Every cursor read past the end lands here, e.g. an unclosed container
+        raise ValueError("Unexpected end of JSON data") from None
 
     return positions
 
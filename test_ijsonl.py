@@ -0,0 +1,178 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from ijsonl import IJSONL
+
+
+class HeaderVersionTest(unittest.TestCase):
+    """Stores whose header this version cannot read are refused on open."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'store.ijsonl')
+        os.makedirs(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_header(self, header: bytes):
+        with open(os.path.join(self.path, 'header.bin'), 'wb') as f:
+            f.write(header)
+
+    def test_current_version_opens(self):
+        with IJSONL(self.path) as db:
+            db.add_record({'a': 1})
+        with IJSONL(self.path) as db:
+            self.assertEqual(db.get_record(0, 'a'), {'a': b'1'})
+
+    def test_wrong_magic(self):
+        self.write_header(struct.pack('<6sHQQ', b'NOTIJS', IJSONL.FORMAT_VERSION, 0, 0))
+        with self.assertRaisesRegex(ValueError, 'not an ijsonl header'):
+            IJSONL(self.path)
+
+    def test_unknown_version(self):
+        self.write_header(IJSONL.HEADER_STRUCT.pack(IJSONL.MAGIC, IJSONL.FORMAT_VERSION + 1, 0, 0))
+        with self.assertRaisesRegex(ValueError, f'format version {IJSONL.FORMAT_VERSION + 1}'):
+            IJSONL(self.path)
+
+    def test_unversioned_header_asks_to_migrate(self):
+        # Version 1 headers start directly with n and num_fields, then the field names
+        self.write_header(struct.pack('<QQ', 3, 1) + struct.pack('<H', 10) + b'__RECORD__')
+        with self.assertRaisesRegex(ValueError, r'migrate it by adding the records in .*data\.jsonl'):
+            IJSONL(self.path)
+
+
+class CrashDuringCommitTest(unittest.TestCase):
+    """Kill a writer between the writes of commit() and reopen the store."""
+
+    committed = [{'a': i, 'b': i} for i in range(10)]
+    # A new field, and rows that skip 'b', so the commit has gap runs to write
+    uncommitted = [{'a': i, 'c': [i]} if i % 2 else {'a': i, 'b': i} for i in range(10, 15)]
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def crash_during_commit(self, method, field=None):
+        """Write both batches in a child process that exits when `method` is called."""
+        pid = os.fork()
+        if pid == 0:
+            try:
+                db = IJSONL(self.path)
+                db.add_records(self.committed)
+                db.commit()
+                db.add_records(self.uncommitted)
+
+                def crash(*args):
+                    if field is None or args[0] == field:
+                        os._exit(0)
+                    return original(*args)
+                original = getattr(db, method)
+                setattr(db, method, crash)
+                db.commit()
+            finally:
+                os._exit(1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0, "commit finished without crashing")
+
+    def assert_readable(self, records):
+        """Check the reopened store holds exactly `records` and still takes appends."""
+        records = records + [{'a': 99, 'c': [2]}]
+        with IJSONL(self.path) as db:
+            self.assertEqual(db.get_header_info()[0], len(records) - 1)
+            db.add_record(records[-1])
+        with IJSONL(self.path) as db:
+            self.assertEqual(db.get_header_info()[0], len(records))
+            for i, record in enumerate(records):
+                self.assertEqual(json.loads(db.get_record(i)), record)
+                for field in ('a', 'b', 'c'):
+                    value = db.get_record(i, [field])
+                    if field in record:
+                        self.assertEqual(json.loads(value[field]), record[field])
+                    else:
+                        self.assertIsNone(value)
+
+    def test_crash_before_index_headers(self):
+        self.crash_during_commit('_write_index_header')
+        self.assert_readable(self.committed)
+
+    def test_crash_before_record_index_header(self):
+        # Field index headers already cover the uncommitted rows
+        self.crash_during_commit('_write_index_header', '__RECORD__')
+        self.assert_readable(self.committed)
+
+    def test_crash_before_header(self):
+        # The record index is complete, so n is recovered from it
+        self.crash_during_commit('_write_header')
+        self.assert_readable(self.committed + self.uncommitted)
+
+
+class UnclosedStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_del_warns_and_keeps_committed_records(self):
+        db = IJSONL(self.path)
+        db.add_record({'a': 1})
+        db.commit()
+        db.add_record({'a': 2})
+        with self.assertWarns(ResourceWarning):
+            del db
+        # The uncommitted record is dropped as after a crash
+        with IJSONL(self.path) as db:
+            self.assertEqual(db.get_header_info()[0], 1)
+            self.assertEqual(db.get_record(0, 'a'), {'a': b'1'})
+
+
+class ParallelScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_store(self, name, workers):
+        records = [{'id': i, 'name': f'n{i}', 'tags': list(range(i % 4))} if i % 3 else {'id': i, 'x': {'y': i}}
+                   for i in range(5000)]
+        path = os.path.join(self.tmp, name)
+        with IJSONL(path) as db:
+            db.PARALLEL_MIN_RECORDS = 1  # Scan every batch in the worker pool
+            db.add_records(records[:3000], workers=workers)
+            executor = db._executor
+            db.add_records(records[3000:], workers=workers)
+            # The pool is started once and reused for later batches
+            self.assertEqual(executor is not None, workers > 1)
+            self.assertIs(db._executor, executor)
+        return path + '.ijsonl'
+
+    def read_files(self, path):
+        files = {}
+        for directory, _, names in os.walk(path):
+            for name in names:
+                with open(os.path.join(directory, name), 'rb') as f:
+                    files[os.path.relpath(os.path.join(directory, name), path)] = f.read()
+        return files
+
+    def test_workers_write_identical_files(self):
+        serial = self.read_files(self.write_store('serial', workers=1))
+        parallel = self.read_files(self.write_store('parallel', workers=2))
+        self.assertEqual(sorted(serial), sorted(parallel))
+        for name in serial:
+            self.assertEqual(serial[name], parallel[name], name)
+
+
+if __name__ == '__main__':
+    unittest.main()
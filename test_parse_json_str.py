@@ -0,0 +1,80 @@
+import json
+import unittest
+
+from parse_json_str import parse_json_positions_binary
+
+
+def reference_positions(value, path="", base=None):
+    """Walk json.loads output and return the paths parse_json_positions_binary should find."""
+    if base is None:
+        # Top-level keys have no leading dot; top-level list items start with one
+        base = "" if isinstance(value, dict) else "."
+    paths = {path: value}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            child_path = base + key
+            paths.update(reference_positions(child, child_path, f"{child_path}."))
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            child_path = base + str(index)
+            paths.update(reference_positions(child, child_path, f"{child_path}."))
+    return paths
+
+
+class ParseJsonPositionsTest(unittest.TestCase):
+    documents = [
+        {"a": "hello\"", "b": {"c": [1, 2, {"c3": "\"{}[]\""}]}, "e": False},
+        {"quote": "say \"hi\"", "escaped": "\\\"", "backslashes": "\\\\", "mixed": "a\\\\\\\"b\\"},
+        {"empty": {}, "list": [], "nested": [[], {}, [[{}]], {"x": []}]},
+        [1, "two", [3, {"four": 4}], {}, []],
+        [[[]]],
+        {"ключ": "значение", "キー": ["値", {"ñ": "ü"}], "emoji": "😀"},
+        {"nan": float("nan"), "inf": float("inf"), "ninf": float("-inf"), "list": [float("nan"), -1.5e-7]},
+        {"numbers": [0, -0, 12, -3.25, 1e20, 1.5E+3, 2e-5, 10 ** 30], "bool": [True, False, None]},
+    ]
+
+    def assert_matches_reference(self, data: bytes):
+        positions = parse_json_positions_binary(data)
+        expected = reference_positions(json.loads(data))
+        self.assertEqual(set(positions), set(expected))
+        for path, (start, end) in positions.items():
+            # Compare through json.dumps so NaN equals NaN
+            self.assertEqual(json.dumps(json.loads(data[start:end])), json.dumps(expected[path]), path)
+
+    def test_matches_json_loads(self):
+        for document in self.documents:
+            # Keys are not unescaped, so non-ASCII keys are written raw
+            for dumps in (lambda d: json.dumps(d, ensure_ascii=False),
+                          lambda d: json.dumps(d, ensure_ascii=False, separators=(',', ':')),
+                          lambda d: json.dumps(d, ensure_ascii=False, indent=2)):
+                data = dumps(document).encode('utf-8')
+                with self.subTest(data=data):
+                    self.assert_matches_reference(data)
+
+    def test_escaped_keys_are_kept_raw(self):
+        positions = parse_json_positions_binary(b'{"\\u00f1": 1, "a\\"b": 2}')
+        self.assertEqual(set(positions), {'\\u00f1', 'a\\"b', ''})
+
+    def test_truncated_input_raises_value_error(self):
+        for document in self.documents:
+            data = json.dumps(document, ensure_ascii=False).encode('utf-8')
+            for end in range(len(data)):
+                with self.subTest(data=data[:end]):
+                    with self.assertRaises(ValueError):
+                        parse_json_positions_binary(data[:end])
+
+    def test_invalid_numbers(self):
+        for number in (b'1-2e+.', b'-', b'01', b'1.', b'.5', b'1e', b'+1', b'--1', b'-Inf'):
+            with self.subTest(number=number):
+                with self.assertRaises(ValueError):
+                    parse_json_positions_binary(b'{"a": ' + number + b'}')
+
+    def test_invalid_keywords(self):
+        for value in (b'tru', b'nul', b'Nan', b'Infinit', b'falsy'):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parse_json_positions_binary(b'{"a": ' + value + b'}')
+
+
+if __name__ == '__main__':
+    unittest.main()